@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import Future
+from contextlib import closing
+from datetime import datetime
+from io import BytesIO
+
+
+# Pillow save() keyword, default and valid range for each format's compression setting.
+# Note the directions differ: a higher PNG level means a smaller file, a higher quality a larger one.
+COMPRESSION_ARGS = {
+    "png": ("compress_level", 6, 0, 9),   # 0 (none) .. 9 (smallest)
+    "webp": ("quality", 90, 0, 100),
+    "jpeg": ("quality", 90, 0, 95),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sha256 TEXT NOT NULL,
+    path TEXT NOT NULL,
+    input TEXT,
+    iteration INTEGER,
+    positive_prompt TEXT,
+    negative_prompt TEXT,
+    seed INTEGER,
+    settings TEXT,
+    scores TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_artifacts_sha256 ON artifacts (sha256);
+CREATE INDEX IF NOT EXISTS idx_artifacts_input ON artifacts (input, iteration);
+"""
+
+_STOP = object()
+
+
+class ArtifactStore:
+    """
+    Content-addressed store for generated images.
+
+    Images are written to <root>/<aa>/<bb>/<sha256>.<ext> and every save is
+    recorded in a SQLite index (<root>/index.sqlite) together with its input,
+    iteration, prompts, seed, settings and scores. Encoding, hashing and
+    writing happen on a background thread so the generation loop never waits
+    on disk; put() returns a Future resolving to the stored row.
+    """
+
+    def __init__(self, root: str = "workdir/artifacts", image_format: str = "png",
+                 compression: int = None, max_pending: int = 64):
+        image_format = image_format.lower()
+        if image_format not in COMPRESSION_ARGS:
+            raise ValueError(f"Unsupported image format: {image_format}")
+
+        _, default, low, high = COMPRESSION_ARGS[image_format]
+        if compression is None:
+            compression = default
+        if not low <= compression <= high:
+            raise ValueError(f"Compression for {image_format} must be between {low} and {high}, got {compression}")
+
+        self.root = root
+        self.image_format = image_format
+        self.compression = compression
+        self.index_path = os.path.join(root, "index.sqlite")
+        os.makedirs(root, exist_ok=True)
+
+        # Create the schema up front so queries work before the first write
+        with closing(sqlite3.connect(self.index_path)) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+        self._closed = False
+        # Held while checking _closed and enqueueing, so nothing can land behind _STOP
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+        self._writer.start()
+
+    # -------------------------------
+    # Public API
+    # -------------------------------
+    def put(self, image, input: str = None, iteration: int = None, positive_prompt: str = "",
+            negative_prompt: str = "", seed: int = None, settings: dict = None,
+            scores: dict = None) -> Future:
+        """
+        Queue an image for saving. Returns a Future resolving to the index row (dict).
+        """
+        future = Future()
+        # Copy so later in-place edits by the caller cannot race with the writer
+        self._enqueue(("put", future, image.copy(), {
+            "input": input,
+            "iteration": iteration,
+            "positive_prompt": positive_prompt,
+            "negative_prompt": negative_prompt,
+            "seed": seed,
+            "settings": json.dumps(settings or {}, sort_keys=True),
+            "scores": json.dumps(scores or {}, sort_keys=True),
+        }))
+        return future
+
+    def record_scores(self, artifact, scores: dict) -> Future:
+        """
+        Queue an update of the scores stored for an indexed artifact. `artifact` is
+        either the row id or the Future returned by put(), so callers never wait on disk.
+        """
+        future = Future()
+        self._enqueue(("scores", future, artifact, json.dumps(scores or {}, sort_keys=True)))
+        return future
+
+    def query(self, **filters) -> list:
+        """
+        Return index rows matching the given column filters, e.g.
+        store.query(input="cat.png", iteration=3). Rows are dicts in insertion order.
+        """
+        columns = {"id", "sha256", "input", "iteration", "seed", "positive_prompt", "negative_prompt"}
+        unknown = set(filters) - columns
+        if unknown:
+            raise ValueError(f"Unknown filter columns: {sorted(unknown)}")
+
+        sql = "SELECT * FROM artifacts"
+        if filters:
+            sql += " WHERE " + " AND ".join(f"{name} = ?" for name in filters)
+        sql += " ORDER BY id"
+
+        with closing(sqlite3.connect(self.index_path)) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(sql, tuple(filters.values())).fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def flush(self):
+        """
+        Block until every queued write has been committed.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Flush pending writes and stop the writer thread.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put((_STOP,))
+        self._writer.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # -------------------------------
+    # Writer thread
+    # -------------------------------
+    def _run(self):
+        conn = sqlite3.connect(self.index_path)
+        try:
+            while True:
+                item = self._queue.get()
+                try:
+                    if item[0] is _STOP:
+                        return
+                    kind, future = item[0], item[1]
+                    try:
+                        if kind == "put":
+                            result = self._write_image(conn, item[2], item[3])
+                        else:
+                            result = self._write_scores(conn, item[2], item[3])
+                        future.set_result(result)
+                    except Exception as e:
+                        print("Artifact store write failed:", e)
+                        future.set_exception(e)
+                finally:
+                    self._queue.task_done()
+        finally:
+            conn.close()
+
+    def _write_image(self, conn, image, meta: dict) -> dict:
+        byte_arr = BytesIO()
+        save_args = {COMPRESSION_ARGS[self.image_format][0]: self.compression}
+        image.save(byte_arr, format=self.image_format.upper(), **save_args)
+        data = byte_arr.getvalue()
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+
+        # Identical content is only written once; the index still records every save
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        row = dict(meta, sha256=digest, path=path, created_at=datetime.now().isoformat())
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO artifacts (sha256, path, input, iteration, positive_prompt, negative_prompt, "
+                "seed, settings, scores, created_at) VALUES (:sha256, :path, :input, :iteration, "
+                ":positive_prompt, :negative_prompt, :seed, :settings, :scores, :created_at)",
+                row,
+            )
+        row["id"] = cursor.lastrowid
+        row["settings"] = json.loads(row["settings"])
+        row["scores"] = json.loads(row["scores"])
+        return row
+
+    def _write_scores(self, conn, artifact, scores: str) -> int:
+        # put() requests are queued first, so the row already exists (or its write failed)
+        artifact_id = artifact.result()["id"] if isinstance(artifact, Future) else artifact
+        with conn:
+            cursor = conn.execute("UPDATE artifacts SET scores = ? WHERE id = ?", (scores, artifact_id))
+        return cursor.rowcount
+
+    # -------------------------------
+    # Helpers
+    # -------------------------------
+    def _enqueue(self, item):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("ArtifactStore is closed")
+            self._queue.put(item)
+
+    def path_for(self, digest: str) -> str:
+        """
+        Sharded location for a content hash: <root>/<aa>/<bb>/<digest>.<ext>
+        """
+        ext = "jpg" if self.image_format == "jpeg" else self.image_format
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.{ext}")
+
+    @staticmethod
+    def _row_to_dict(row) -> dict:
+        record = dict(row)
+        record["settings"] = json.loads(record["settings"] or "{}")
+        record["scores"] = json.loads(record["scores"] or "{}")
+        return record
@@ -1,18 +1,125 @@
 from diffusers import DiffusionPipeline
 import torch
-from datetime import datetime
+import atexit
+import os
+import ollama
+from artifact_store import ArtifactStore
+from memory_arbiter import MemoryArbiter, GIB, UNLOAD_NOW
 
-def generate_image(positive_prompt: str, negative_prompt, seed: int = 42, save: bool = False):
+MODEL_ID = "SG161222/RealVisXL_V5.0"
+NUM_INFERENCE_STEPS = 40
+VLM_MODEL = "gemma3"
 
-    torch.cuda.empty_cache()
-    torch.cuda.synchronize()  # Wait for all GPU operations to finish
-    
-    pipeline = DiffusionPipeline.from_pretrained(
-        "SG161222/RealVisXL_V5.0",
+# Accelerator memory shared by Ollama and the diffusion pipeline; defaults to 90% of the card
+MEMORY_BUDGET_GIB = float(os.environ.get("MEMORY_BUDGET_GIB", 0)) or None
+
+# Settings recorded alongside every stored image
+PIPELINE_SETTINGS = {
+    "model": MODEL_ID,
+    "num_inference_steps": NUM_INFERENCE_STEPS,
+    "torch_dtype": "float16",
+}
+
+_default_store = None
+
+
+def get_default_store() -> ArtifactStore:
+    global _default_store
+    if _default_store is None:
+        _default_store = ArtifactStore()
+        atexit.register(_default_store.close)  # Don't drop queued writes on exit
+    return _default_store
+
+
+_pipeline = None
+_arbiter = None
+
+
+def _load_pipeline():
+    global _pipeline
+    _pipeline = DiffusionPipeline.from_pretrained(
+        MODEL_ID,
         torch_dtype=torch.float16,
         safety_checker=None
     )
-    pipeline.to("cuda")
+    _pipeline.to("cuda")
+    unet_bytes = sum(p.numel() * p.element_size() for p in _pipeline.unet.parameters())
+    get_arbiter().update_footprint(diffusion_bytes=torch.cuda.memory_allocated(), unet_bytes=unet_bytes)
+
+
+def _move_pipeline(device: str, unet_only: bool = False):
+    (_pipeline.unet if unet_only else _pipeline).to(device)
+    if device == "cpu":
+        # Hand the freed blocks back to the driver so the Ollama process can use them
+        torch.cuda.synchronize()
+        torch.cuda.empty_cache()
+
+
+def _unload_vlm():
+    ollama.generate(model=VLM_MODEL, keep_alive=UNLOAD_NOW)
+
+
+def _release_vlm():
+    # Calls pass keep_alive=-1, so hand gemma3's memory back to Ollama when the run ends
+    if _arbiter is not None and _arbiter.vlm_resident:
+        try:
+            _unload_vlm()
+            _arbiter.vlm_resident = False
+        except Exception as e:
+            print("Could not unload VLM from Ollama:", e)
+
+
+def _measure_vlm():
+    # Replace the estimated VLM size with what Ollama actually reports
+    try:
+        for model in ollama.ps().models:
+            if model.model.split(":")[0] == VLM_MODEL and model.size_vram:
+                get_arbiter().update_footprint(vlm_bytes=model.size_vram)
+    except Exception as e:
+        print("Could not query Ollama for loaded models:", e)
+
+
+def get_arbiter() -> MemoryArbiter:
+    global _arbiter
+    if _arbiter is None:
+        if MEMORY_BUDGET_GIB:
+            budget_bytes = int(MEMORY_BUDGET_GIB * GIB)
+        else:
+            budget_bytes = int(torch.cuda.get_device_properties(0).total_memory * 0.9)
+        _arbiter = MemoryArbiter(budget_bytes, handlers={
+            "load_diffusion": _load_pipeline,
+            "diffusion_to_gpu": lambda: _move_pipeline("cuda"),
+            "unet_to_cpu": lambda: _move_pipeline("cpu", unet_only=True),
+            "diffusion_to_cpu": lambda: _move_pipeline("cpu"),
+            "unload_vlm": _unload_vlm,
+        })
+        atexit.register(_release_vlm)  # Also runs after an exception or Ctrl-C
+    return _arbiter
+
+
+def prepare_vlm():
+    """
+    Make room for the Ollama VLM before a chat call and return the keep_alive to pass to it.
+    """
+    arbiter = get_arbiter()
+    arbiter.enter("vlm")
+    return arbiter.vlm_keep_alive()
+
+
+def generate_image(positive_prompt: str, negative_prompt, seed: int = 42, save: bool = False,
+                   store: ArtifactStore = None, input: str = None, iteration: int = None):
+    """
+    Generate an image and return (image, artifact). With save=True, artifact is the
+    Future from ArtifactStore.put(); pass it to record_scores() to attach evaluations.
+    Otherwise artifact is None.
+    """
+
+    arbiter = get_arbiter()
+    if arbiter.vlm_resident:
+        _measure_vlm()
+    arbiter.enter("diffusion")
+
+    pipeline = _pipeline
     generator = torch.Generator("cuda").manual_seed(seed)
 
     image = pipeline(
@@ -20,18 +127,24 @@ def generate_image(positive_prompt: str, negative_prompt, seed: int = 42, save:
         negative_prompt=negative_prompt,
         generator=generator,
         #cfg_scale=15.0,          # Higher CFG scale makes the model follow the prompt more strictly
-        num_inference_steps=40,  # More steps usually produce more detailed and accurate images
+        num_inference_steps=NUM_INFERENCE_STEPS,  # More steps usually produce more detailed and accurate images
         #guidance_rescale=0.7,    # Optional: can help make prompt adherence stronger without over-saturation
     ).images[0]
 
+    artifact = None
     if save:
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        save_path = f"workdir/generated_{timestamp}.png"
-        image.save(save_path)
+        # Written in the background to the content-addressed store (see artifact_store.py)
+        artifact = (store or get_default_store()).put(
+            image,
+            input=input,
+            iteration=iteration,
+            positive_prompt=positive_prompt,
+            negative_prompt=negative_prompt,
+            seed=seed,
+            settings=PIPELINE_SETTINGS,
+        )
 
-    # Manually free GPU memory
-    del pipeline
-    torch.cuda.empty_cache()
-    torch.cuda.synchronize()  # Wait for all GPU operations to finish
+    # Peak usage includes activations, which is what the VLM has to fit next to
+    arbiter.update_footprint(diffusion_bytes=torch.cuda.max_memory_allocated())
 
-    return image
+    return image, artifact
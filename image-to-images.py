@@ -1,20 +1,24 @@
 import json
-from diffusion_pipeline import generate_image
+from diffusion_pipeline import generate_image, prepare_vlm, get_arbiter
+from artifact_store import ArtifactStore
 from ollama import AsyncClient
 import asyncio
 from PIL import Image
 from io import BytesIO
 import os
-from datetime import datetime
 
-# Helper function to load image bytes
-def load_image_bytes(path):
-    with Image.open(path) as img:
+# Helper function to load image bytes from a path or an in-memory PIL image
+def load_image_bytes(image):
+    if isinstance(image, Image.Image):
+        byte_arr = BytesIO()
+        image.save(byte_arr, format='PNG')
+        return byte_arr.getvalue()
+    with Image.open(image) as img:
         byte_arr = BytesIO()
         img.save(byte_arr, format='PNG')
         return byte_arr.getvalue()
 
-async def evaluate_images_text(positive_prompt: str, negative_prompt: str, image_path1: str, image_path2: str) -> dict:
+async def evaluate_images_text(positive_prompt: str, negative_prompt: str, image_path1: str, image2) -> dict:
     """
     Optimized version:
     - Call 1: Describe detailed differences between original & enhanced image
@@ -24,7 +28,7 @@ async def evaluate_images_text(positive_prompt: str, negative_prompt: str, image
     client = AsyncClient()
 
     img_bytes1 = load_image_bytes(image_path1)
-    img_bytes2 = load_image_bytes(image_path2)
+    img_bytes2 = load_image_bytes(image2)
 
     # -------------------------------
     # Step 1: Get differences
@@ -41,7 +45,8 @@ async def evaluate_images_text(positive_prompt: str, negative_prompt: str, image
             ),
             "images": [img_bytes1, img_bytes2],
         }],
-        options={"temperature": 0.3}
+        options={"temperature": 0.3},
+        keep_alive=prepare_vlm()
     )
 
     try:
@@ -66,7 +71,8 @@ async def evaluate_images_text(positive_prompt: str, negative_prompt: str, image
             ),
             "images": [img_bytes1],
         }],
-        options={"temperature": 0.7}
+        options={"temperature": 0.7},
+        keep_alive=prepare_vlm()
     )
 
     try:
@@ -90,7 +96,8 @@ async def evaluate_images_text(positive_prompt: str, negative_prompt: str, image
                 "Return JSON: {\"negative_prompt\": [\"...\"]}"
             )
         }],
-        options={"temperature": 0.7}
+        options={"temperature": 0.7},
+        keep_alive=prepare_vlm()
     )
 
     try:
@@ -149,7 +156,7 @@ async def refine_prompts(image_prompt: str, negative_prompt: str, prompts_json:
                 'temperature': 0.7,
                 'num_gpu': 99
             },
-            keep_alive='1s'
+            keep_alive=prepare_vlm()
         )
 
         content = response.message.content
@@ -209,7 +216,7 @@ async def gen_image_prompt(image_path: str) -> dict:
             'temperature': 0.7,
             'num_gpu': 99
         },
-        keep_alive='1s'
+        keep_alive=prepare_vlm()
     )
 
     # Extract JSON from model response
@@ -231,52 +238,62 @@ async def main():
     image_prompt = "1boy"
     negative_prompt = "bad quality, worst quality, low quality, lowres, normal quality, jpeg artifacts, ugly, duplicate, morbid, mutilated, out of frame, extra fingers, mutated hands and fingers, poorly drawn hands and fingers, poorly drawn face, deformed, blurry, dehydrated, bad proportions, cloned face, disfigured, gross proportions, malformed limbs, missing arms and legs, fused fingers, too many fingers, long neck, photoshop"
 
-    generated_image = generate_image(image_prompt, negative_prompt, seed=42, save=True)
-    #generated_image.save("workdir/generated_initial.png")
-
-    directory = "inputs"
-    for filename in os.listdir(directory):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            print(f"Processing image: {filename}")
-            image_path = os.path.join(directory, filename)
-
-            initial_prompts = await gen_image_prompt(image_path)
-            positive_prompt = initial_prompts.get("positive_prompt", "")
-            negative_prompt = initial_prompts.get("negative_prompt", "")
-            print("Initial Positive Prompt:", positive_prompt)
-            print("Initial Negative Prompt:", negative_prompt)
-
-            for i in range(20):
-                print(f"\n--- Iteration {i+1} ---")
-
-                generated_image = generate_image(positive_prompt, negative_prompt, seed=42, save=False)
-                timestamp = "{:02d}_{}".format(i, datetime.now().strftime("%Y%m%d_%H%M%S"))
-                generated_image_path = f"workdir/generated_{filename.split('.')[0]}_{timestamp}.png"
-                generated_image.save(generated_image_path)
-                print(f"Generated image saved to: {generated_image_path}")
-
-
-                # Step 3: Evaluate and refine prompts using the original and generated images
-                evaluated_prompts = await evaluate_images_text(positive_prompt, negative_prompt, image_path, generated_image_path)
-                print("Evaluated Prompts:", evaluated_prompts)
-
-                refined_prompt = await refine_prompts(positive_prompt, negative_prompt, evaluated_prompts)
-                print("Refined Prompts:", refined_prompt)
-
-                # Step 4: Generate a new refined prompt.
-                if refined_prompt:
-                    positive_prompts = refined_prompt.get("positive_prompts", None)
-                    negative_prompts = refined_prompt.get("negative_prompts", None)
-
-                    positive_prompt = ", ".join(positive_prompts) if isinstance(positive_prompts, list) and len(positive_prompts) > 1 else (str(positive_prompts) if positive_prompts else "")
-                    negative_prompt = ", ".join(negative_prompts) if isinstance(negative_prompts, list) and len(negative_prompts) > 1 else (str(negative_prompts) if negative_prompts else "")
-
-                    print("Updated Positive Prompt:", positive_prompt)
-                    print("Updated Negative Prompt:", negative_prompt)
-                else:
-                    print("No refined prompts received, stopping iteration.")
-                    break
-            break
+    # Closing the store (also on errors/Ctrl-C) flushes queued images to disk
+    with ArtifactStore("workdir/artifacts") as store:
+        generated_image, _ = generate_image(image_prompt, negative_prompt, seed=42, save=True, store=store)
+        #generated_image.save("workdir/generated_initial.png")
+
+        directory = "inputs"
+        for filename in os.listdir(directory):
+            if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+                print(f"Processing image: {filename}")
+                image_path = os.path.join(directory, filename)
+
+                initial_prompts = await gen_image_prompt(image_path)
+                positive_prompt = initial_prompts.get("positive_prompt", "")
+                negative_prompt = initial_prompts.get("negative_prompt", "")
+                print("Initial Positive Prompt:", positive_prompt)
+                print("Initial Negative Prompt:", negative_prompt)
+
+                for i in range(20):
+                    print(f"\n--- Iteration {i+1} ---")
+
+                    generated_image, artifact = generate_image(positive_prompt, negative_prompt, seed=42, save=True,
+                                                               store=store, input=filename, iteration=i)
+                    print(f"Generated image queued for saving to: {store.root}")
+
+
+                    # Step 3: Evaluate and refine prompts using the original and generated images
+                    evaluated_prompts = await evaluate_images_text(positive_prompt, negative_prompt, image_path, generated_image)
+                    print("Evaluated Prompts:", evaluated_prompts)
+
+                    refined_prompt = await refine_prompts(positive_prompt, negative_prompt, evaluated_prompts)
+                    print("Refined Prompts:", refined_prompt)
+                    store.record_scores(artifact, {
+                        "differences": evaluated_prompts.get("differences", []),
+                        "evaluated_prompts": {
+                            "positive_prompt": evaluated_prompts.get("positive_prompt", []),
+                            "negative_prompt": evaluated_prompts.get("negative_prompt", []),
+                        },
+                        "refined_prompts": refined_prompt,
+                    })
+
+                    # Step 4: Generate a new refined prompt.
+                    if refined_prompt:
+                        positive_prompts = refined_prompt.get("positive_prompts", None)
+                        negative_prompts = refined_prompt.get("negative_prompts", None)
+
+                        positive_prompt = ", ".join(positive_prompts) if isinstance(positive_prompts, list) and len(positive_prompts) > 1 else (str(positive_prompts) if positive_prompts else "")
+                        negative_prompt = ", ".join(negative_prompts) if isinstance(negative_prompts, list) and len(negative_prompts) > 1 else (str(negative_prompts) if negative_prompts else "")
+
+                        print("Updated Positive Prompt:", positive_prompt)
+                        print("Updated Negative Prompt:", negative_prompt)
+                    else:
+                        print("No refined prompts received, stopping iteration.")
+                        break
+                break
+
+    print(get_arbiter().report())
 
 
 if __name__ == "__main__":
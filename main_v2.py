@@ -1,22 +1,26 @@
 import json
-from diffusion_pipeline import generate_image
+from diffusion_pipeline import generate_image, prepare_vlm, get_arbiter
+from artifact_store import ArtifactStore
 from ollama import AsyncClient
 import asyncio
 from PIL import Image
 from io import BytesIO
 import os
-from datetime import datetime
 
 
-# Helper function to load image bytes
-def load_image_bytes(path):
-    with Image.open(path) as img:
+# Helper function to load image bytes from a path or an in-memory PIL image
+def load_image_bytes(image):
+    if isinstance(image, Image.Image):
+        byte_arr = BytesIO()
+        image.save(byte_arr, format='PNG')
+        return byte_arr.getvalue()
+    with Image.open(image) as img:
         byte_arr = BytesIO()
         img.save(byte_arr, format='PNG')
         return byte_arr.getvalue()
 
 
-async def evaluate_images_text(positive_prompt: str, negative_prompt: str, image_path1: str, image_path2: str) -> dict:
+async def evaluate_images_text(positive_prompt: str, negative_prompt: str, image_path1: str, image2) -> dict:
     """
     Evaluate AI generated images via their description and the images themselves,
     and return parsed JSON containing positive and negative prompts.
@@ -24,7 +28,7 @@ async def evaluate_images_text(positive_prompt: str, negative_prompt: str, image
     client = AsyncClient()
 
     img_bytes1 = load_image_bytes(image_path1)
-    img_bytes2 = load_image_bytes(image_path2)
+    img_bytes2 = load_image_bytes(image2)
 
     response = await client.chat(
         model="gemma3",
@@ -44,7 +48,7 @@ async def evaluate_images_text(positive_prompt: str, negative_prompt: str, image
             'seed': 42,
             'temperature': 0.7,
         },
-        keep_alive='1s'
+        keep_alive=prepare_vlm()
     )
 
     # Extract JSON from model response
@@ -93,7 +97,7 @@ async def gen_image_prompt(image_path: str) -> dict:
             'seed': 42,
             'temperature': 0.7,
         },
-        keep_alive='1s'
+        keep_alive=prepare_vlm()
     )
 
     # Extract JSON from model response
@@ -135,7 +139,7 @@ in JSON format like {{ "positive_prompts": [...], "negative_prompts": [...] }}.
         'seed': 42,  # Set a specific seed for reproducible results
         'temperature': 0.7,
         },
-        keep_alive='1s'  # Keep the connection alive for 1 second
+        keep_alive=prepare_vlm()  # Memory arbiter decides when gemma3 is unloaded
     )
 
     # Parse JSON from response
@@ -176,7 +180,7 @@ Please generate in JSON format like {{ "prompts": [...]}}.
         'seed': 42,  # Set a specific seed for reproducible results
         'temperature': 0.7,
         },
-        keep_alive='1s'  # Keep the connection alive for 1 second
+        keep_alive=prepare_vlm()  # Memory arbiter decides when gemma3 is unloaded
     )
 
     # Parse JSON from response
@@ -197,52 +201,58 @@ Please generate in JSON format like {{ "prompts": [...]}}.
 
 
 async def main():
-    # Iterate all images in inputs directory
-    directory = "inputs"
-    for filename in os.listdir(directory):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            image_path = os.path.join(directory, filename)
-            print(f"Processing image: {image_path}")
-
-            # Step 1: Generate initial prompts from the image
-            initial_prompts = await gen_image_prompt(image_path)
-            positive_prompt = initial_prompts.get("positive_prompt", "")
-            negative_prompt = initial_prompts.get("negative_prompt", "")
-
-            for i in range(2):
-                print(f"\n--- Iteration {i+1} ---")
-
-                print("Initial Prompts:", initial_prompts)
-                print(f"Positive Prompt: {positive_prompt}")
-                print(f"Negative Prompt: {negative_prompt}")
-                #break
-                # Step 2: Generate an image using the initial prompts
-                generated_image = generate_image(positive_prompt, negative_prompt, seed=1234, save=True)
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                generated_image_path = f"workdir/generated_{filename.split('.')[0]}_{i}_{timestamp}.png"
-                generated_image.save(generated_image_path)
-                print(f"Generated image saved to: {generated_image_path}")
-                break
-                # Step 3: Evaluate and refine prompts using the original and generated images
-                evaluated_prompts = await evaluate_images_text(positive_prompt, negative_prompt, image_path, generated_image_path)
-                print("Evaluated Prompts:", evaluated_prompts)
-
-                refined_prompt = await refine_prompts(positive_prompt, negative_prompt, evaluated_prompts)
-                print("Refined Prompts:", refined_prompt)
-
-                # Step 4: Generate a new refined prompt.
-                if refined_prompt:
-                    # Join lists into comma-separated strings if needed
-                    positive_prompt = ", ".join(refined_prompt.get("positive_prompts", []))
-                    negative_prompt = ", ".join(refined_prompt.get("negative_prompts", []))
-                else:
-                    print("No refined prompts received, stopping iteration.")
+    # Closing the store (also on errors/Ctrl-C) flushes queued images to disk
+    with ArtifactStore("workdir/artifacts") as store:
+        # Iterate all images in inputs directory
+        directory = "inputs"
+        for filename in os.listdir(directory):
+            if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+                image_path = os.path.join(directory, filename)
+                print(f"Processing image: {image_path}")
+
+                # Step 1: Generate initial prompts from the image
+                initial_prompts = await gen_image_prompt(image_path)
+                positive_prompt = initial_prompts.get("positive_prompt", "")
+                negative_prompt = initial_prompts.get("negative_prompt", "")
+
+                for i in range(2):
+                    print(f"\n--- Iteration {i+1} ---")
+
+                    print("Initial Prompts:", initial_prompts)
+                    print(f"Positive Prompt: {positive_prompt}")
+                    print(f"Negative Prompt: {negative_prompt}")
+                    #break
+                    # Step 2: Generate an image using the initial prompts
+                    generated_image, artifact = generate_image(positive_prompt, negative_prompt, seed=1234, save=True,
+                                                               store=store, input=filename, iteration=i)
+                    print(f"Generated image queued for saving to: {store.root}")
                     break
-                # Ensure prompts are within token limits
-                positive_prompt = await token_limit(positive_prompt)
-                negative_prompt = await token_limit(negative_prompt)
-                #break
-        break
+                    # Step 3: Evaluate and refine prompts using the original and generated images
+                    evaluated_prompts = await evaluate_images_text(positive_prompt, negative_prompt, image_path, generated_image)
+                    print("Evaluated Prompts:", evaluated_prompts)
+
+                    refined_prompt = await refine_prompts(positive_prompt, negative_prompt, evaluated_prompts)
+                    print("Refined Prompts:", refined_prompt)
+                    store.record_scores(artifact, {
+                        "evaluated_prompts": evaluated_prompts,
+                        "refined_prompts": refined_prompt,
+                    })
+
+                    # Step 4: Generate a new refined prompt.
+                    if refined_prompt:
+                        # Join lists into comma-separated strings if needed
+                        positive_prompt = ", ".join(refined_prompt.get("positive_prompts", []))
+                        negative_prompt = ", ".join(refined_prompt.get("negative_prompts", []))
+                    else:
+                        print("No refined prompts received, stopping iteration.")
+                        break
+                    # Ensure prompts are within token limits
+                    positive_prompt = await token_limit(positive_prompt)
+                    negative_prompt = await token_limit(negative_prompt)
+                    #break
+            break
+
+    print(get_arbiter().report())
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,178 @@
+GIB = 1024 ** 3
+
+# Rough fp16 footprints used until real sizes are measured
+DEFAULT_VLM_BYTES = int(6.0 * GIB)         # gemma3 as reported by `ollama ps`
+DEFAULT_DIFFUSION_BYTES = int(7.5 * GIB)   # RealVisXL (SDXL) pipeline incl. activations
+DEFAULT_UNET_BYTES = int(5.0 * GIB)        # SDXL UNet alone
+
+# Ollama keep_alive values: keep the model loaded until the arbiter unloads it
+KEEP_RESIDENT = -1
+UNLOAD_NOW = 0
+
+STAGES = ("vlm", "diffusion")
+
+# Diffusion pipeline locations
+NOT_LOADED = "none"       # not in memory at all; using it needs a load from disk
+ON_CPU = "cpu"            # whole pipeline parked in host memory
+UNET_ON_CPU = "partial"   # UNet in host memory, the rest (VAE, text encoders) on the GPU
+ON_GPU = "gpu"
+
+
+class MemoryArbiter:
+    """
+    Decides which model stays on the accelerator between pipeline stages.
+
+    The arbiter tracks the footprint of the Ollama VLM and the diffusion
+    pipeline against a memory budget. Before each stage, enter(stage) returns
+    the actions needed to make room, cheapest first:
+
+    - both models fit in the budget: keep both resident, do nothing
+    - VLM stage: move the diffusion UNet to CPU, or the whole pipeline if
+      that is not enough
+    - diffusion stage: ask Ollama to unload the VLM
+
+    Actions are strings ("load_vlm", "unload_vlm", "load_diffusion",
+    "diffusion_to_gpu", "unet_to_cpu", "diffusion_to_cpu"). If a handler is
+    registered for an action it is called, otherwise the arbiter only updates
+    its bookkeeping, so the policy can be exercised with simulated sizes.
+    """
+
+    def __init__(self, budget_bytes: int, vlm_bytes: int = DEFAULT_VLM_BYTES,
+                 diffusion_bytes: int = DEFAULT_DIFFUSION_BYTES, unet_bytes: int = DEFAULT_UNET_BYTES,
+                 handlers: dict = None):
+        if unet_bytes > diffusion_bytes:
+            raise ValueError("unet_bytes cannot exceed diffusion_bytes")
+
+        self.budget_bytes = budget_bytes
+        self.vlm_bytes = vlm_bytes
+        self.diffusion_bytes = diffusion_bytes
+        self.unet_bytes = unet_bytes
+        self.handlers = handlers or {}
+
+        self.vlm_resident = False
+        self.diffusion_location = NOT_LOADED
+        self.previous_stage = None
+
+        self.stats = {
+            "vlm_loads": 0,
+            "diffusion_loads": 0,
+            "vlm_unloads": 0,
+            "diffusion_offloads": 0,
+            "reloads_avoided": 0,
+        }
+
+    # -------------------------------
+    # Memory accounting
+    # -------------------------------
+    def diffusion_gpu_bytes(self) -> int:
+        if self.diffusion_location == ON_GPU:
+            return self.diffusion_bytes
+        if self.diffusion_location == UNET_ON_CPU:
+            return self.diffusion_bytes - self.unet_bytes
+        return 0
+
+    def gpu_bytes(self) -> int:
+        return (self.vlm_bytes if self.vlm_resident else 0) + self.diffusion_gpu_bytes()
+
+    def update_footprint(self, vlm_bytes: int = None, diffusion_bytes: int = None, unet_bytes: int = None):
+        """
+        Replace estimated sizes with measured ones (e.g. from `ollama ps` or torch).
+        """
+        if vlm_bytes:
+            self.vlm_bytes = vlm_bytes
+        if diffusion_bytes:
+            self.diffusion_bytes = diffusion_bytes
+        if unet_bytes:
+            self.unet_bytes = min(unet_bytes, self.diffusion_bytes)
+
+    # -------------------------------
+    # Policy
+    # -------------------------------
+    def plan(self, stage: str) -> list:
+        """
+        Return the actions needed before `stage` without changing any state.
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage: {stage}")
+
+        actions = []
+        if stage == "vlm":
+            if self.vlm_resident:
+                return actions
+            # Offload as little of the diffusion pipeline as needed for the VLM to fit.
+            # Nothing to offload if it is not on the GPU, even when the VLM alone exceeds the budget.
+            diffusion_gpu = self.diffusion_gpu_bytes()
+            if diffusion_gpu and self.vlm_bytes + diffusion_gpu > self.budget_bytes:
+                without_unet = self.diffusion_bytes - self.unet_bytes
+                if self.diffusion_location == ON_GPU and self.vlm_bytes + without_unet <= self.budget_bytes:
+                    actions.append("unet_to_cpu")
+                else:
+                    actions.append("diffusion_to_cpu")
+            actions.append("load_vlm")
+        else:
+            if self.vlm_resident and self.vlm_bytes + self.diffusion_bytes > self.budget_bytes:
+                actions.append("unload_vlm")
+            if self.diffusion_location == NOT_LOADED:
+                actions.append("load_diffusion")
+            elif self.diffusion_location != ON_GPU:
+                actions.append("diffusion_to_gpu")
+        return actions
+
+    def enter(self, stage: str) -> list:
+        """
+        Prepare memory for `stage`: run the planned actions and update bookkeeping.
+        """
+        actions = self.plan(stage)
+
+        # Without the arbiter every generate_image loaded the pipeline from disk, and the
+        # VLM had expired by the first call after a diffusion stage. Back-to-back VLM
+        # calls were not reloads, so they are not counted.
+        if stage == "diffusion" and "load_diffusion" not in actions:
+            self.stats["reloads_avoided"] += 1
+        if stage == "vlm" and self.previous_stage == "diffusion" and "load_vlm" not in actions:
+            self.stats["reloads_avoided"] += 1
+        self.previous_stage = stage
+
+        for action in actions:
+            handler = self.handlers.get(action)
+            if handler is not None:
+                handler()
+            self._apply(action)
+        return actions
+
+    def _apply(self, action: str):
+        if action == "load_vlm":
+            self.vlm_resident = True
+            self.stats["vlm_loads"] += 1
+        elif action == "unload_vlm":
+            self.vlm_resident = False
+            self.stats["vlm_unloads"] += 1
+        elif action == "load_diffusion":
+            self.diffusion_location = ON_GPU
+            self.stats["diffusion_loads"] += 1
+        elif action == "diffusion_to_gpu":
+            self.diffusion_location = ON_GPU
+        elif action == "unet_to_cpu":
+            self.diffusion_location = UNET_ON_CPU
+            self.stats["diffusion_offloads"] += 1
+        elif action == "diffusion_to_cpu":
+            self.diffusion_location = ON_CPU
+            self.stats["diffusion_offloads"] += 1
+
+    def vlm_keep_alive(self):
+        """
+        keep_alive value for Ollama calls. The arbiter unloads the VLM itself when
+        the diffusion stage needs the memory, so Ollama should never expire it.
+        Callers must unload it when the run ends (see diffusion_pipeline._release_vlm).
+        """
+        return KEEP_RESIDENT
+
+    def report(self) -> str:
+        s = self.stats
+        return (
+            f"Memory arbiter: {s['reloads_avoided']} model reloads avoided, "
+            f"{s['vlm_loads']} VLM loads, {s['vlm_unloads']} VLM unloads, "
+            f"{s['diffusion_loads']} diffusion loads, {s['diffusion_offloads']} diffusion offloads "
+            f"(budget {self.budget_bytes / GIB:.1f} GiB)"
+        )
+
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+from artifact_store import ArtifactStore
+
+
+class StubImage:
+    """
+    Minimal stand-in for a PIL image: save() writes its payload plus the format and
+    save arguments, so different content or settings give different bytes.
+    """
+
+    def __init__(self, payload: bytes):
+        self.payload = payload
+
+    def copy(self):
+        return type(self)(self.payload)
+
+    def save(self, fp, format, **kwargs):
+        fp.write(self.payload + format.encode() + repr(sorted(kwargs.items())).encode())
+
+
+@pytest.fixture
+def store(tmp_path):
+    with ArtifactStore(str(tmp_path / "artifacts")) as store:
+        yield store
+
+
+def test_sharded_path_layout(store):
+    row = store.put(StubImage(b"red"), input="cat.png", iteration=0).result()
+
+    digest = row["sha256"]
+    assert row["path"] == os.path.join(store.root, digest[:2], digest[2:4], f"{digest}.png")
+    assert os.path.isfile(row["path"])
+
+
+def test_identical_content_is_stored_once(store):
+    first = store.put(StubImage(b"red"), input="cat.png", iteration=0).result()
+    second = store.put(StubImage(b"red"), input="cat.png", iteration=1).result()
+
+    assert first["path"] == second["path"]
+    assert first["id"] != second["id"]
+    assert len(os.listdir(os.path.dirname(first["path"]))) == 1
+    assert [row["iteration"] for row in store.query(input="cat.png")] == [0, 1]
+
+
+def test_record_scores_accepts_put_future(store):
+    artifact = store.put(StubImage(b"red"), input="cat.png")
+    store.record_scores(artifact, {"differences": ["hands"]}).result()
+
+    assert store.query(id=artifact.result()["id"])[0]["scores"] == {"differences": ["hands"]}
+
+
+def test_record_scores_fails_when_put_failed(store):
+    class BrokenImage(StubImage):
+        def save(self, fp, format, **kwargs):
+            raise OSError("disk full")
+
+    artifact = store.put(BrokenImage(b""))
+    with pytest.raises(OSError):
+        store.record_scores(artifact, {"score": 1}).result()
+
+
+@pytest.mark.parametrize("image_format, expected", [("png", 6), ("jpeg", 90), ("webp", 90)])
+def test_default_compression_per_format(tmp_path, image_format, expected):
+    with ArtifactStore(str(tmp_path), image_format=image_format) as store:
+        assert store.compression == expected
+
+
+@pytest.mark.parametrize("image_format, compression", [("png", 10), ("jpeg", 96), ("webp", -1)])
+def test_compression_out_of_range(tmp_path, image_format, compression):
+    with pytest.raises(ValueError):
+        ArtifactStore(str(tmp_path), image_format=image_format, compression=compression)
+
+
+def test_query_filters(store):
+    store.put(StubImage(b"a"), input="cat.png", iteration=0, seed=1)
+    store.put(StubImage(b"b"), input="cat.png", iteration=1, seed=1)
+    store.put(StubImage(b"c"), input="dog.png", iteration=0, seed=2, settings={"steps": 40})
+    store.flush()
+
+    assert len(store.query()) == 3
+    assert [row["iteration"] for row in store.query(input="cat.png")] == [0, 1]
+    dog = store.query(input="dog.png", iteration=0)
+    assert len(dog) == 1 and dog[0]["settings"] == {"steps": 40}
+    with pytest.raises(ValueError):
+        store.query(scores="{}")
+
+
+def test_put_after_close_raises(tmp_path):
+    store = ArtifactStore(str(tmp_path))
+    artifact = store.put(StubImage(b"red"))
+    store.close()
+
+    assert artifact.result()["id"] == 1
+    with pytest.raises(RuntimeError):
+        store.put(StubImage(b"red"))
+    with pytest.raises(RuntimeError):
+        store.record_scores(artifact, {})
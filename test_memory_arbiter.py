@@ -0,0 +1,88 @@
+import pytest
+
+from memory_arbiter import GIB, MemoryArbiter, ON_CPU, ON_GPU
+
+ITERATION = ["vlm", "diffusion", "vlm"]
+
+
+def simulate(budget_gib, stages):
+    """
+    Run stages through an arbiter with simulated sizes: VLM 6 GiB, pipeline 7.5 GiB, UNet 5 GiB.
+    """
+    arbiter = MemoryArbiter(int(budget_gib * GIB), vlm_bytes=int(6 * GIB),
+                            diffusion_bytes=int(7.5 * GIB), unet_bytes=int(5 * GIB))
+    return arbiter, [arbiter.enter(stage) for stage in stages]
+
+
+def test_both_models_fit():
+    arbiter, actions = simulate(24, ITERATION * 3)
+
+    assert actions[:2] == [["load_vlm"], ["load_diffusion"]]
+    assert all(a == [] for a in actions[2:])
+    assert arbiter.vlm_resident and arbiter.diffusion_location == ON_GPU
+    # 2 generate_image calls after the first, 3 VLM calls following a diffusion stage
+    assert arbiter.stats["reloads_avoided"] == 5
+
+
+def test_only_unet_moves():
+    # 6 + 7.5 exceeds 12 GiB, but 6 + 2.5 fits once the UNet is on CPU
+    arbiter, actions = simulate(12, ITERATION * 2)
+
+    assert actions == [
+        ["load_vlm"],
+        ["unload_vlm", "load_diffusion"],
+        ["unet_to_cpu", "load_vlm"],
+        [],
+        ["unload_vlm", "diffusion_to_gpu"],
+        ["unet_to_cpu", "load_vlm"],
+    ]
+    assert arbiter.stats["diffusion_loads"] == 1
+    assert arbiter.stats["reloads_avoided"] == 1
+
+
+def test_whole_pipeline_moves():
+    # 6 + 2.5 still exceeds 8 GiB, so the UNet alone is not enough
+    arbiter, actions = simulate(8, ITERATION)
+
+    assert actions == [["load_vlm"], ["unload_vlm", "load_diffusion"], ["diffusion_to_cpu", "load_vlm"]]
+    assert arbiter.diffusion_location == ON_CPU
+
+
+def test_budget_smaller_than_vlm():
+    arbiter, actions = simulate(4, ITERATION + ["vlm", "diffusion"])
+
+    # The pipeline is only offloaded once it is actually on the GPU
+    assert actions == [
+        ["load_vlm"],
+        ["unload_vlm", "load_diffusion"],
+        ["diffusion_to_cpu", "load_vlm"],
+        [],
+        ["unload_vlm", "diffusion_to_gpu"],
+    ]
+    assert arbiter.stats["diffusion_offloads"] == 1
+
+
+@pytest.mark.parametrize("budget_gib", [24, 12, 8, 4])
+def test_vlm_called_first(budget_gib):
+    arbiter, actions = simulate(budget_gib, ["vlm", "vlm", "diffusion"])
+
+    assert actions[:2] == [["load_vlm"], []]
+    assert "load_diffusion" in actions[2] and "diffusion_to_gpu" not in actions[2]
+    assert arbiter.stats["reloads_avoided"] == 0
+
+
+def test_handlers_run_in_order():
+    calls = []
+    arbiter = MemoryArbiter(int(8 * GIB), vlm_bytes=int(6 * GIB), diffusion_bytes=int(7.5 * GIB),
+                            unet_bytes=int(5 * GIB),
+                            handlers={name: (lambda name=name: calls.append(name))
+                                      for name in ("unload_vlm", "load_diffusion", "diffusion_to_cpu")})
+    for stage in ITERATION:
+        arbiter.enter(stage)
+
+    assert calls == ["unload_vlm", "load_diffusion", "diffusion_to_cpu"]
+
+
+def test_unknown_stage():
+    with pytest.raises(ValueError):
+        MemoryArbiter(int(8 * GIB)).plan("upscale")
@@ -1,10 +1,10 @@
 import json
-from diffusion_pipeline import generate_image
+from diffusion_pipeline import generate_image, prepare_vlm, get_arbiter
+from artifact_store import ArtifactStore
 from ollama import AsyncClient
 import asyncio
 from PIL import Image
 from io import BytesIO
-from datetime import datetime
 
 async def evaluate_image_text(positive_prompt: str, negative_prompt: str, image: Image.Image) -> dict:
     """
@@ -35,7 +35,7 @@ async def evaluate_image_text(positive_prompt: str, negative_prompt: str, image:
         'seed': 42,  # Set a specific seed for reproducible results
         'temperature': 0.7,
         },
-        keep_alive='1s'  # Keep the connection alive for 1 second
+        keep_alive=prepare_vlm()  # Memory arbiter decides when gemma3 is unloaded
     )
 
     # Attempt to extract JSON from the model's response
@@ -60,32 +60,34 @@ async def main():
     new_positive_prompt = image_prompt
     new_negative_prompt = negative_prompt
 
-    for i in range(10):
-        print(f"--- Iteration {i+1} ---")
+    # Closing the store (also on errors/Ctrl-C) flushes queued images to disk
+    with ArtifactStore("workdir/artifacts") as store:
+        for i in range(10):
+            print(f"--- Iteration {i+1} ---")
 
-        image = generate_image(new_positive_prompt, new_negative_prompt, seed=42)
+            image, artifact = generate_image(new_positive_prompt, new_negative_prompt, seed=42, save=True,
+                                             store=store, iteration=i)
+            print(f"Generated image queued for saving to: {store.root}")
 
-        timestamp = "{:02d}_{}".format(i, datetime.now().strftime("%Y%m%d_%H%M%S"))
-        generated_image_path = f"workdir/generated_{timestamp}.png"
-        image.save(generated_image_path)
-        print(f"Generated image saved to: {generated_image_path}")
+            # Evaluate using both prompt and image
+            improved_prompts = await evaluate_image_text(image_prompt, negative_prompt, image)
+            store.record_scores(artifact, {"improved_prompts": improved_prompts})
+            #print("Extracted prompts JSON:", prompts_json)
 
-        # Evaluate using both prompt and image
-        improved_prompts = await evaluate_image_text(image_prompt, negative_prompt, image)
-        #print("Extracted prompts JSON:", prompts_json)
+            if improved_prompts:
+                # Join lists into comma-separated strings if needed
+                new_positive_prompt = improved_prompts.get("positive_prompt", [])
+                new_negative_prompt = improved_prompts.get("negative_prompt", [])
+                new_positive_prompt = ", ".join(new_positive_prompt) if isinstance(new_positive_prompt, list) and len(new_positive_prompt) > 1 else (str(new_positive_prompt) if new_positive_prompt else "")
+                new_negative_prompt = ", ".join(new_negative_prompt) if isinstance(new_negative_prompt, list) and len(new_negative_prompt) > 1 else (str(new_negative_prompt) if new_negative_prompt else "")
 
-        if improved_prompts:
-            # Join lists into comma-separated strings if needed
-            new_positive_prompt = improved_prompts.get("positive_prompt", [])
-            new_negative_prompt = improved_prompts.get("negative_prompt", [])
-            new_positive_prompt = ", ".join(new_positive_prompt) if isinstance(new_positive_prompt, list) and len(new_positive_prompt) > 1 else (str(new_positive_prompt) if new_positive_prompt else "")
-            new_negative_prompt = ", ".join(new_negative_prompt) if isinstance(new_negative_prompt, list) and len(new_negative_prompt) > 1 else (str(new_negative_prompt) if new_negative_prompt else "")
+            # Print all prompts for reference
+            print("Current Positive Prompt:", new_positive_prompt)
+            print("Current Negative Prompt:", new_negative_prompt)
+            print(" original Positive Prompt:", image_prompt)
+            print(" original Negative Prompt:", negative_prompt)
 
-        # Print all prompts for reference
-        print("Current Positive Prompt:", new_positive_prompt)
-        print("Current Negative Prompt:", new_negative_prompt)
-        print(" original Positive Prompt:", image_prompt)
-        print(" original Negative Prompt:", negative_prompt)
+    print(get_arbiter().report())
 
 
 if __name__ == "__main__":